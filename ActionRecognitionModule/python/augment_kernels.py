@@ -0,0 +1,104 @@
+"""
+Numeric kernels used by augment_sequences.py.
+
+Every kernel works on a padded, feature-major (copies, feature_dim, max_len)
+float32 batch, so each feature's frames are contiguous. All random draws happen
+in the caller; these functions only take ndarrays so they can be compiled with
+Numba when it is installed. The first run after
+installing Numba compiles every kernel (this can take tens of seconds); the
+result is cached next to this file and reused by later runs. Without Numba the
+same functions fall back to plain NumPy.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+
+
+def _random_crop_py(batch: np.ndarray, starts: np.ndarray, crop_lens: np.ndarray) -> np.ndarray:
+    frame_idx = starts[:, None] + np.arange(crop_lens.max())[None, :]
+    frame_idx = np.minimum(frame_idx, batch.shape[2] - 1)
+    return np.take_along_axis(batch, frame_idx[:, None, :], axis=2)
+
+
+def _time_scale_py(batch: np.ndarray, target_idx: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    lower = np.take_along_axis(batch, target_idx[:, None, :], axis=2)
+    upper = np.take_along_axis(batch, target_idx[:, None, :] + 1, axis=2)
+    return lower + weights[:, None, :] * (upper - lower)
+
+
+def _time_mask_py(batch: np.ndarray, starts: np.ndarray, chunk_lens: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    masked = batch.copy()
+    for c in range(batch.shape[0]):
+        for start in starts[c]:
+            masked[c, columns, start : start + chunk_lens[c]] = 0.0
+    return masked
+
+
+def _noise_scale_py(batch: np.ndarray, scales: np.ndarray, noise: np.ndarray, noise_first: bool) -> np.ndarray:
+    if noise_first:
+        out = batch + noise
+        out *= scales[:, :, None]
+    else:
+        out = batch * scales[:, :, None]
+        out += noise
+    return out
+
+
+def _random_crop_nb(batch, starts, crop_lens):
+    out = np.zeros((batch.shape[0], batch.shape[1], crop_lens.max()), dtype=batch.dtype)
+    for c in range(batch.shape[0]):
+        for j in range(batch.shape[1]):
+            out[c, j, : crop_lens[c]] = batch[c, j, starts[c] : starts[c] + crop_lens[c]]
+    return out
+
+
+def _time_scale_nb(batch, target_idx, weights):
+    out = np.empty((batch.shape[0], batch.shape[1], target_idx.shape[1]), dtype=batch.dtype)
+    for c in range(batch.shape[0]):
+        for j in range(batch.shape[1]):
+            for i in range(target_idx.shape[1]):
+                lower = target_idx[c, i]
+                out[c, j, i] = batch[c, j, lower] + weights[c, i] * (batch[c, j, lower + 1] - batch[c, j, lower])
+    return out
+
+
+def _time_mask_nb(batch, starts, chunk_lens, columns):
+    masked = batch.copy()
+    for c in range(batch.shape[0]):
+        for k in range(starts.shape[1]):
+            for col in columns:
+                masked[c, col, starts[c, k] : starts[c, k] + chunk_lens[c]] = 0.0
+    return masked
+
+
+def _noise_scale_nb(batch, scales, noise, noise_first):
+    out = np.empty_like(batch)
+    for c in range(batch.shape[0]):
+        for j in range(batch.shape[1]):
+            scale = scales[c, j]
+            for i in range(batch.shape[2]):
+                if noise_first:
+                    out[c, j, i] = (batch[c, j, i] + noise[c, j, i]) * scale
+                else:
+                    out[c, j, i] = batch[c, j, i] * scale + noise[c, j, i]
+    return out
+
+
+if NUMBA_AVAILABLE:
+    random_crop_kernel = njit(cache=True, fastmath=True)(_random_crop_nb)
+    time_scale_kernel = njit(cache=True, fastmath=True)(_time_scale_nb)
+    time_mask_kernel = njit(cache=True, fastmath=True)(_time_mask_nb)
+    noise_scale_kernel = njit(cache=True, fastmath=True)(_noise_scale_nb)
+else:
+    random_crop_kernel = _random_crop_py
+    time_scale_kernel = _time_scale_py
+    time_mask_kernel = _time_mask_py
+    noise_scale_kernel = _noise_scale_py
@@ -13,14 +13,26 @@ to apply and how many augmented copies per original sequence to generate.
 from __future__ import annotations
 
 import argparse
+import base64
 import json
-import math
-import random
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Sequence
+from typing import Dict, List, Sequence, Tuple
 
 import numpy as np
 
+from augment_kernels import noise_scale_kernel, random_crop_kernel, time_mask_kernel, time_scale_kernel
+from sequence_io import load_features, read_payload
+
+# Optional: orjson serializes ndarrays directly and is much faster than json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Augment PillowMate sequence data.")
@@ -46,6 +58,12 @@ def parse_args() -> argparse.Namespace:
         help="Augmentation operations to apply (in order).",
     )
     parser.add_argument("--copies", type=int, default=2, help="Augmented variants per original sequence.")
+    parser.add_argument(
+        "--target-length",
+        type=int,
+        default=None,
+        help="Reflect-pad or truncate every copy to this many frames after the last random_crop/time_scale.",
+    )
     parser.add_argument("--min-crop-ratio", type=float, default=0.4, help="Minimum ratio for random crop.")
     parser.add_argument("--max-crop-ratio", type=float, default=0.9, help="Maximum ratio for random crop.")
     parser.add_argument("--min-scale", type=float, default=0.7, help="Minimum time scale factor.")
@@ -83,7 +101,22 @@ def parse_args() -> argparse.Namespace:
         default=["pressure"],
         help="Which feature groups to zero during time_mask (default pressure only).",
     )
+    parser.add_argument(
+        "--output-format",
+        choices=["json", "b64", "npz"],
+        default="json",
+        help=(
+            "json: features inline as nested lists. b64: features inline as base64 float32 bytes. "
+            "npz: compressed float32 .npz next to a small JSON metadata file."
+        ),
+    )
     parser.add_argument("--seed", type=int, default=42, help="Random seed for reproducibility.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes augmenting files in parallel (1 = serial).",
+    )
     parser.add_argument("--include-original", action="store_true", help="Copy original sequences into output.")
     parser.add_argument(
         "--split-by-session",
@@ -93,6 +126,14 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def write_payload(path: Path, payload: Dict) -> None:
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2))
+        return
+    payload = {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in payload.items()}
+    path.write_text(json.dumps(payload, indent=2), encoding="utf8")
+
+
 def load_sequences(data_dirs: Sequence[Path]) -> List[Path]:
     paths: List[Path] = []
     for data_dir in data_dirs:
@@ -103,50 +144,123 @@ def load_sequences(data_dirs: Sequence[Path]) -> List[Path]:
     return paths
 
 
-def random_crop(sequence: np.ndarray, rng: random.Random, min_ratio: float, max_ratio: float) -> np.ndarray:
-    if sequence.shape[0] < 2:
-        return sequence
-    ratio = rng.uniform(min_ratio, max_ratio)
-    crop_len = max(2, int(math.ceil(sequence.shape[0] * ratio)))
-    if crop_len >= sequence.shape[0]:
-        return sequence
-    start = rng.randint(0, sequence.shape[0] - crop_len)
-    return sequence[start : start + crop_len]
-
-
-def time_scale(sequence: np.ndarray, rng: random.Random, min_scale: float, max_scale: float) -> np.ndarray:
-    if sequence.shape[0] < 2:
-        return sequence
-    scale = rng.uniform(min_scale, max_scale)
-    new_len = max(2, int(round(sequence.shape[0] * scale)))
-    original = np.arange(sequence.shape[0])
-    target = np.linspace(0, sequence.shape[0] - 1, num=new_len)
-    resampled = np.empty((new_len, sequence.shape[1]), dtype=np.float32)
-    for feature_idx in range(sequence.shape[1]):
-        resampled[:, feature_idx] = np.interp(target, original, sequence[:, feature_idx])
-    return resampled
-
-
-def add_noise(sequence: np.ndarray, rng: random.Random, noise_std: float) -> np.ndarray:
-    noise = np.random.normal(0.0, noise_std, size=sequence.shape).astype(np.float32)
-    return sequence + noise
-
+def draw_perturbations(
+    rng: np.random.Generator, num_files: int, copies: int, ops: List[str], args: argparse.Namespace
+) -> List[Dict[str, np.ndarray]]:
+    """
+    Sample the per-copy uniforms of every op for all files in one call per knob.
 
-def time_shift(sequence: np.ndarray, rng: random.Random, max_ratio: float) -> np.ndarray:
-    if sequence.shape[0] < 2 or max_ratio <= 0:
-        return sequence
-    max_shift = max(1, int(sequence.shape[0] * max_ratio))
-    shift = rng.randint(-max_shift, max_shift)
-    if shift == 0:
-        return sequence
-    return np.roll(sequence, shift, axis=0)
-
-
-def amplitude_scale(sequence: np.ndarray, rng: random.Random, min_scale: float, max_scale: float) -> np.ndarray:
+    Each entry lines up with ``ops`` and maps a knob name to an array of shape
+    (num_files, copies[, chunks]) in [0, 1); the ops rescale them to their own
+    ranges. Draws whose shape depends on the loaded sequence (noise, per-feature
+    amplitude scales) stay on the per-file generator.
+    """
+    size = (num_files, copies)
+    draws: List[Dict[str, np.ndarray]] = []
+    for op in ops:
+        if op == "random_crop":
+            draws.append({"ratio": rng.random(size), "start": rng.random(size)})
+        elif op == "time_scale":
+            draws.append({"scale": rng.random(size)})
+        elif op == "time_shift":
+            draws.append({"shift": rng.random(size)})
+        elif op == "time_mask":
+            draws.append({"start": rng.random(size + (max(1, args.time_mask_chunks),))})
+        else:
+            draws.append({})
+    return draws
+
+
+def random_crop(
+    batch: np.ndarray, lengths: np.ndarray, draws: Dict[str, np.ndarray], min_ratio: float, max_ratio: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    if batch.shape[2] < 2:
+        return batch, lengths
+    ratios = min_ratio + (max_ratio - min_ratio) * draws["ratio"]
+    crop_lens = np.maximum(2, np.ceil(lengths * ratios)).astype(np.int64)
+    crop_lens = np.minimum(crop_lens, lengths)
+    starts = (draws["start"] * (lengths - crop_lens + 1)).astype(np.int64)
+    return random_crop_kernel(batch, starts, crop_lens), crop_lens
+
+
+def time_scale(
+    batch: np.ndarray, lengths: np.ndarray, draws: Dict[str, np.ndarray], min_scale: float, max_scale: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    if batch.shape[2] < 2:
+        return batch, lengths
+    scales = min_scale + (max_scale - min_scale) * draws["scale"]
+    new_lens = np.maximum(2, np.round(lengths * scales)).astype(np.int64)
+    # Sample positions on each copy's own time axis; frames past new_lens are padding.
+    steps = (lengths - 1) / (new_lens - 1)
+    target = np.minimum(np.arange(new_lens.max())[None, :] * steps[:, None], (lengths - 1)[:, None])
+    idx = np.clip(np.floor(target).astype(np.int64), 0, (lengths - 2)[:, None])
+    weights = (target - idx).astype(np.float32)
+    return time_scale_kernel(batch, idx, weights), new_lens
+
+
+def draw_noise(rng: np.random.Generator, shape: tuple, noise_std: float) -> np.ndarray:
+    noise = rng.standard_normal(shape, dtype=np.float32)
+    noise *= noise_std
+    return noise
+
+
+def add_noise(
+    batch: np.ndarray, lengths: np.ndarray, rng: np.random.Generator, noise_std: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    return batch + draw_noise(rng, batch.shape, noise_std), lengths
+
+
+def time_shift(
+    batch: np.ndarray, lengths: np.ndarray, draws: Dict[str, np.ndarray], max_ratio: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    if batch.shape[2] < 2 or max_ratio <= 0:
+        return batch, lengths
+    max_shifts = np.maximum(1, (lengths * max_ratio).astype(np.int64))
+    shifts = (draws["shift"] * (2 * max_shifts + 1)).astype(np.int64) - max_shifts
+    # Two slice copies per copy wrap the frames around without np.roll's extra pass.
+    shifted = np.empty_like(batch)
+    for copy_idx, (length, shift) in enumerate(zip(lengths, shifts)):
+        k = shift % length
+        shifted[copy_idx, :, :k] = batch[copy_idx, :, length - k : length]
+        shifted[copy_idx, :, k:length] = batch[copy_idx, :, : length - k]
+        shifted[copy_idx, :, length:] = batch[copy_idx, :, length:]
+    return shifted, lengths
+
+
+def amplitude_scale(
+    batch: np.ndarray, lengths: np.ndarray, rng: np.random.Generator, min_scale: float, max_scale: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    if min_scale <= 0 or max_scale <= 0:
+        return batch, lengths
+    return batch * draw_amplitude_scales(rng, batch.shape, min_scale, max_scale)[:, :, None], lengths
+
+
+def draw_amplitude_scales(rng: np.random.Generator, shape: tuple, min_scale: float, max_scale: float) -> np.ndarray:
+    scales = rng.random(shape[:2], dtype=np.float32)
+    scales *= max_scale - min_scale
+    scales += min_scale
+    return scales
+
+
+def noise_and_amplitude_scale(
+    batch: np.ndarray,
+    lengths: np.ndarray,
+    rng: np.random.Generator,
+    noise_std: float,
+    min_scale: float,
+    max_scale: float,
+    noise_first: bool,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Adjacent noise + amplitude_scale ops in one pass over the batch, drawing in the same order."""
     if min_scale <= 0 or max_scale <= 0:
-        return sequence
-    scales = np.random.uniform(min_scale, max_scale, size=(sequence.shape[1],)).astype(np.float32)
-    return sequence * scales
+        return add_noise(batch, lengths, rng, noise_std)
+    if noise_first:
+        noise = draw_noise(rng, batch.shape, noise_std)
+        scales = draw_amplitude_scales(rng, batch.shape, min_scale, max_scale)
+    else:
+        scales = draw_amplitude_scales(rng, batch.shape, min_scale, max_scale)
+        noise = draw_noise(rng, batch.shape, noise_std)
+    return noise_scale_kernel(batch, scales, noise, noise_first), lengths
 
 
 FEATURE_COLUMN_GROUPS = {
@@ -156,14 +270,21 @@ FEATURE_COLUMN_GROUPS = {
 }
 
 
-def time_mask(sequence: np.ndarray, rng: random.Random, ratio: float, chunks: int, targets: List[str]) -> np.ndarray:
-    if ratio <= 0 or sequence.shape[0] < 2:
-        return sequence
-    total_frames = max(1, int(sequence.shape[0] * min(ratio, 1.0)))
-    chunk_len = max(1, total_frames // max(1, chunks))
-    masked = sequence.copy()
+def time_mask(
+    batch: np.ndarray,
+    lengths: np.ndarray,
+    draws: Dict[str, np.ndarray],
+    ratio: float,
+    chunks: int,
+    targets: List[str],
+) -> Tuple[np.ndarray, np.ndarray]:
+    if ratio <= 0 or batch.shape[2] < 2:
+        return batch, lengths
+    chunks = max(1, chunks)
+    total_frames = np.maximum(1, (lengths * min(ratio, 1.0)).astype(np.int64))
+    chunk_lens = np.maximum(1, total_frames // chunks)
     if "all" in targets:
-        columns = list(range(sequence.shape[1]))
+        columns = list(range(batch.shape[1]))
     else:
         columns = []
         for target in targets:
@@ -171,30 +292,87 @@ def time_mask(sequence: np.ndarray, rng: random.Random, ratio: float, chunks: in
         columns = sorted(set(columns))
     if not columns:
         columns = FEATURE_COLUMN_GROUPS["pressure"]
-    for _ in range(max(1, chunks)):
-        start = rng.randint(0, max(0, sequence.shape[0] - chunk_len))
-        masked[start : start + chunk_len, columns] = 0.0
-    return masked
+    max_starts = np.maximum(0, lengths - chunk_lens)
+    starts = (draws["start"] * (max_starts + 1)[:, None]).astype(np.int64)
+    return time_mask_kernel(batch, starts, chunk_lens, np.array(columns, dtype=np.int64)), lengths
 
 
-def apply_ops(sequence: np.ndarray, ops: List[str], rng: random.Random, args: argparse.Namespace) -> np.ndarray:
-    augmented = sequence.copy()
-    for op in ops:
+LENGTH_CHANGING_OPS = ("random_crop", "time_scale")
+
+
+def fit_length(batch: np.ndarray, lengths: np.ndarray, target_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reflect-pad (like np.pad mode="reflect") or truncate every copy to target_length frames."""
+    frames = np.arange(target_length)[None, :]
+    period = np.maximum(2 * (lengths - 1), 1)[:, None]
+    offset = frames % period
+    frame_idx = np.where(offset < lengths[:, None], offset, period - offset)
+    fitted = np.take_along_axis(batch, frame_idx[:, None, :], axis=2)
+    return fitted, np.full_like(lengths, target_length)
+
+
+def apply_ops_batched(
+    sequence: np.ndarray,
+    copies: int,
+    ops: List[str],
+    rng: np.random.Generator,
+    draws: List[Dict[str, np.ndarray]],
+    args: argparse.Namespace,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Augment ``copies`` variants of one sequence at once.
+
+    The batch is kept feature-major, (copies, feature_dim, max_len), so every
+    feature of every copy is one contiguous row of frames. Returns the batch,
+    the valid length of each copy (frames past it are padding and must be
+    ignored) and the length of each copy before --target-length fitting.
+    ``draws`` holds this file's slice of draw_perturbations().
+    """
+    batch = np.repeat(np.ascontiguousarray(sequence.T, dtype=np.float32)[None], copies, axis=0)
+    lengths = np.full(copies, sequence.shape[0], dtype=np.int64)
+    unpadded_lengths = lengths
+    # Fit once, after the last op that changes lengths, so later length-changing ops
+    # never resample padding frames.
+    fit_after = max((idx for idx, op in enumerate(ops) if op in LENGTH_CHANGING_OPS), default=-1)
+    if args.target_length and fit_after < 0:
+        batch, lengths = fit_length(batch, lengths, args.target_length)
+    op_idx = 0
+    while op_idx < len(ops):
+        op, op_draws = ops[op_idx], draws[op_idx]
+        pair = tuple(ops[op_idx : op_idx + 2])
+        if pair in (("noise", "amplitude_scale"), ("amplitude_scale", "noise")):
+            batch, lengths = noise_and_amplitude_scale(
+                batch,
+                lengths,
+                rng,
+                args.noise_std,
+                args.amplitude_scale_min,
+                args.amplitude_scale_max,
+                noise_first=op == "noise",
+            )
+            op_idx += 2
+            continue
         if op == "random_crop":
-            augmented = random_crop(augmented, rng, args.min_crop_ratio, args.max_crop_ratio)
+            batch, lengths = random_crop(batch, lengths, op_draws, args.min_crop_ratio, args.max_crop_ratio)
         elif op == "time_scale":
-            augmented = time_scale(augmented, rng, args.min_scale, args.max_scale)
+            batch, lengths = time_scale(batch, lengths, op_draws, args.min_scale, args.max_scale)
         elif op == "noise":
-            augmented = add_noise(augmented, rng, args.noise_std)
+            batch, lengths = add_noise(batch, lengths, rng, args.noise_std)
         elif op == "time_shift":
-            augmented = time_shift(augmented, rng, args.time_shift_ratio)
+            batch, lengths = time_shift(batch, lengths, op_draws, args.time_shift_ratio)
         elif op == "amplitude_scale":
-            augmented = amplitude_scale(augmented, rng, args.amplitude_scale_min, args.amplitude_scale_max)
+            batch, lengths = amplitude_scale(batch, lengths, rng, args.amplitude_scale_min, args.amplitude_scale_max)
         elif op == "time_mask":
-            augmented = time_mask(augmented, rng, args.time_mask_ratio, args.time_mask_chunks, args.time_mask_targets)
+            batch, lengths = time_mask(
+                batch, lengths, op_draws, args.time_mask_ratio, args.time_mask_chunks, args.time_mask_targets
+            )
         else:
             raise ValueError(f"Unsupported op: {op}")
-    return augmented
+        if op_idx == fit_after:
+            unpadded_lengths = lengths
+            if args.target_length:
+                batch, lengths = fit_length(batch, lengths, args.target_length)
+        op_idx += 1
+    return batch, lengths, unpadded_lengths
 
 
 def save_sequence(
@@ -204,50 +382,89 @@ def save_sequence(
     suffix: str,
     index: int,
     session_name: str | None,
+    output_format: str = "json",
+    unpadded_frame_count: int | None = None,
 ) -> Path:
     target_dir = output_dir / session_name if session_name else output_dir
     target_dir.mkdir(parents=True, exist_ok=True)
-    filename = f"{Path(base_payload['source']).stem}_{suffix}_{index:02d}.json"
-    payload = {
-        **base_payload,
-        "frame_count": sequence.shape[0],
-        "features": sequence.tolist(),
-    }
-    path = target_dir / filename
-    path.write_text(json.dumps(payload, indent=2), encoding="utf8")
+    stem = f"{Path(base_payload['source']).stem}_{suffix}_{index:02d}"
+    features = np.ascontiguousarray(sequence, dtype=np.float32)
+    payload = {**base_payload, "frame_count": sequence.shape[0]}
+    if unpadded_frame_count is not None:
+        payload["unpadded_frame_count"] = unpadded_frame_count
+    if output_format == "npz":
+        # The JSON keeps label/metadata; the float32 frames go to a binary sidecar.
+        np.savez_compressed(target_dir / f"{stem}.npz", features=features)
+        payload["features_file"] = f"{stem}.npz"
+    elif output_format == "b64":
+        # Little-endian float32 bytes; decode with np.frombuffer or a JS Float32Array.
+        payload["features_b64"] = base64.b64encode(features.astype("<f4", copy=False).tobytes()).decode("ascii")
+        payload["features_shape"] = list(features.shape)
+    else:
+        payload["features"] = features
+    path = target_dir / f"{stem}.json"
+    write_payload(path, payload)
     return path
 
 
+def process_file(path: Path, draws: List[Dict[str, np.ndarray]], args: argparse.Namespace, seed_base: int) -> int:
+    # Noise/amplitude draws depend on the loaded shape, so they use a per-file generator
+    # seeded from the path; results do not depend on worker scheduling.
+    file_seed = (seed_base ^ zlib.crc32(str(path).encode("utf8"))) & 0xFFFFFFFF
+    rng = np.random.default_rng(file_seed)
+
+    payload = read_payload(path)
+    features = load_features(payload, path.parent)
+    if features.size == 0:
+        return 0
+    base_payload = {
+        "label": payload["label"],
+        "sample_ms": payload.get("sample_ms", 20),
+        "feature_names": payload.get("feature_names"),
+        "metadata": payload.get("metadata"),
+        "source": str(path),
+    }
+    session_name = Path(path).parent.name if args.split_by_session else None
+    written = 0
+    if args.include_original:
+        save_sequence(base_payload, features, args.output_dir, "orig", 0, session_name, args.output_format)
+        written += 1
+    if not args.ops or args.copies <= 0:
+        return written
+    batch, lengths, unpadded_lengths = apply_ops_batched(features, args.copies, args.ops, rng, draws, args)
+    for copy_idx in range(args.copies):
+        augmented = batch[copy_idx, :, : lengths[copy_idx]].T
+        save_sequence(
+            base_payload,
+            augmented,
+            args.output_dir,
+            "aug",
+            copy_idx + 1,
+            session_name,
+            args.output_format,
+            int(unpadded_lengths[copy_idx]) if args.target_length else None,
+        )
+        written += 1
+    return written
+
+
 def main() -> None:
     args = parse_args()
-    rng = random.Random(args.seed)
-    np.random.seed(args.seed)
-
     input_paths = load_sequences(args.data_dirs)
-    written = 0
+    worker = partial(process_file, args=args, seed_base=args.seed)
+    draws = draw_perturbations(
+        np.random.default_rng(args.seed), len(input_paths), max(0, args.copies), args.ops or [], args
+    )
+    file_draws = [
+        [{knob: values[file_idx] for knob, values in op_draws.items()} for op_draws in draws]
+        for file_idx in range(len(input_paths))
+    ]
 
-    for path in input_paths:
-        payload = json.loads(path.read_text(encoding="utf8"))
-        features = np.array(payload.get("features", []), dtype=np.float32)
-        if features.size == 0:
-            continue
-        base_payload = {
-            "label": payload["label"],
-            "sample_ms": payload.get("sample_ms", 20),
-            "feature_names": payload.get("feature_names"),
-            "metadata": payload.get("metadata"),
-            "source": str(path),
-        }
-        session_name = Path(path).parent.name if args.split_by_session else None
-        if args.include_original:
-            save_sequence(base_payload, features, args.output_dir, "orig", 0, session_name)
-            written += 1
-        if not args.ops:
-            continue
-        for copy_idx in range(1, args.copies + 1):
-            augmented = apply_ops(features, args.ops, rng, args)
-            save_sequence(base_payload, augmented, args.output_dir, "aug", copy_idx, session_name)
-            written += 1
+    if args.workers <= 1 or len(input_paths) == 1:
+        written = sum(map(worker, input_paths, file_draws))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            written = sum(executor.map(worker, input_paths, file_draws))
 
     print(f"Augmentation complete. Wrote {written} sequences to {args.output_dir}")
 
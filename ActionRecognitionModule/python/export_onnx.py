@@ -0,0 +1,94 @@
+"""
+Convert trained PyTorch weights into an ONNX model for sequence_infer.py --backend onnxruntime.
+
+Like export_torchscript.py, the feature normalization from the config is folded
+into the graph, so the model takes raw features plus per-sequence lengths. With
+--int8 an additional dynamically quantized copy (<output>.int8.onnx) is written
+using onnxruntime's quantization tool.
+"""
+
+from __future__ import annotations
+
+import argparse
+import inspect
+import json
+from pathlib import Path
+
+import torch
+
+from sequence_model import NormalizedSequenceModel, build_model
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export a PillowMate sequence model to ONNX.")
+    parser.add_argument(
+        "--model",
+        type=Path,
+        default=Path(__file__).resolve().parents[1] / "models" / "sequence_classifier.pt",
+        help="Path to the trained PyTorch weights.",
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path(__file__).resolve().parents[1] / "models" / "sequence_config.json",
+        help="Path to the JSON config with normalization + labels.",
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the ONNX model (default: <model>.onnx).")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version.")
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="Also write <output>.int8.onnx with MatMul/Gemm/GRU weights quantized to int8 (needs onnxruntime).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    output = args.output or args.model.with_suffix(".onnx")
+    config = json.loads(args.config.read_text(encoding="utf8"))
+    feature_dim = len(config["feature_names"])
+    model = build_model(config.get("model", {}), feature_dim, len(config["labels"]))
+    model.load_state_dict(torch.load(args.model, map_location="cpu"))
+    wrapped = NormalizedSequenceModel(
+        model,
+        torch.tensor(config["feature_mean"], dtype=torch.float32),
+        torch.tensor(config["feature_std"], dtype=torch.float32),
+    ).eval()
+
+    # The exporter traces one branch of SequenceGRU.forward: use a padded batch sorted
+    # longest-first, the same shape sequence_infer.py feeds, so the packed GRU path is kept.
+    sequences = torch.zeros(2, 100, feature_dim)
+    lengths = torch.tensor([100, 60], dtype=torch.long)
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer PyTorch defaults to the torch.export-based exporter, which cannot handle packing.
+        export_kwargs["dynamo"] = False
+    output.parent.mkdir(parents=True, exist_ok=True)
+    torch.onnx.export(
+        wrapped,
+        (sequences, lengths),
+        str(output),
+        input_names=["sequences", "lengths"],
+        output_names=["logits"],
+        dynamic_axes={"sequences": {0: "batch", 1: "seq"}, "lengths": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=args.opset,
+        **export_kwargs,
+    )
+    print(f"Saved ONNX model to {output}")
+
+    if args.int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_output = output.with_suffix(".int8.onnx")
+        quantize_dynamic(
+            str(output),
+            str(int8_output),
+            op_types_to_quantize=["MatMul", "Gemm", "GRU"],
+            weight_type=QuantType.QInt8,
+        )
+        print(f"Saved int8 ONNX model to {int8_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Convert trained PyTorch weights into a TorchScript model for sequence_infer.py.
+
+The exported module folds the feature normalization from the config into the
+graph, so sequence_infer.py can feed raw features and skip building
+the model in Python. Pass the resulting .ts file to sequence_infer.py via
+--model (keep passing the same --config for labels and feature names).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import torch
+
+from sequence_model import NormalizedSequenceModel, build_model
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export a PillowMate sequence model to TorchScript.")
+    parser.add_argument(
+        "--model",
+        type=Path,
+        default=Path(__file__).resolve().parents[1] / "models" / "sequence_classifier.pt",
+        help="Path to the trained PyTorch weights.",
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path(__file__).resolve().parents[1] / "models" / "sequence_config.json",
+        help="Path to the JSON config with normalization + labels.",
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the TorchScript model (default: <model>.ts).")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    output = args.output or args.model.with_suffix(".ts")
+    config = json.loads(args.config.read_text(encoding="utf8"))
+    model = build_model(config.get("model", {}), len(config["feature_names"]), len(config["labels"]))
+    model.load_state_dict(torch.load(args.model, map_location="cpu"))
+    wrapped = NormalizedSequenceModel(
+        model,
+        torch.tensor(config["feature_mean"], dtype=torch.float32),
+        torch.tensor(config["feature_std"], dtype=torch.float32),
+    ).eval()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    torch.jit.script(wrapped).save(str(output))
+    print(f"Saved TorchScript model to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,30 @@
 """
 Run inference on a single variable-length PillowMate sequence.
+
+With --server (or --serve) the model is loaded once and sequences are read as
+newline-delimited JSON from stdin, so repeated calls skip the startup cost.
+Lines that arrive together are classified in one padded batch.
+PyTorch is imported only when a sequence actually reaches the model, so
+--auto-idle hits return without paying the torch import.
 """
 
 from __future__ import annotations
 
 import argparse
+import functools
 import json
+import os
+import queue
 import sys
+import threading
+import time
+import warnings
 from pathlib import Path
-from typing import Dict
+from typing import BinaryIO, Dict, Iterator, List, Sequence, Set
 
 import numpy as np
-import torch
-from torch import nn
 
-from sequence_model import SequenceGRU
+from sequence_io import load_features, parse_payload
 
 
 def parse_args() -> argparse.Namespace:
@@ -23,7 +33,13 @@ def parse_args() -> argparse.Namespace:
         "--model",
         type=Path,
         default=Path(__file__).resolve().parents[1] / "models" / "sequence_classifier.pt",
-        help="Path to the trained PyTorch weights.",
+        help="Path to the trained PyTorch weights, a TorchScript export (.ts), or an ONNX export with --backend onnxruntime.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["torch", "onnxruntime"],
+        default="torch",
+        help="onnxruntime runs an export_onnx.py model on CPU without importing PyTorch.",
     )
     parser.add_argument(
         "--config",
@@ -33,6 +49,49 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--input", type=Path, help="Path to a JSON sequence. Reads stdin if omitted.")
     parser.add_argument("--device", type=str, default="cpu", help="cpu, cuda, or mps.")
+    parser.add_argument(
+        "--quantize",
+        choices=["off", "linear", "all"],
+        default="off",
+        help=(
+            "Dynamic int8 quantization of .pt weights on CPU: off, the Linear head only, or Linear + GRU. "
+            "Activation scales are computed per batch, so batched server results depend on the other lines."
+        ),
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="CPU intra-op threads. One short sequence rarely benefits from more; larger --max-batch may.",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=str,
+        help="Pin the process to these CPU ids, e.g. 0-3 or 0,2 (Linux only). Useful to keep to performance cores.",
+    )
+    parser.add_argument(
+        "--fp32",
+        action="store_true",
+        help="Keep .pt weights in float32 on cuda/mps instead of running them in float16.",
+    )
+    parser.add_argument(
+        "--no-jit",
+        action="store_true",
+        help="Server mode: run .pt weights as a plain nn.Module instead of a frozen TorchScript graph (for debugging).",
+    )
+    parser.add_argument(
+        "--server",
+        "--serve",
+        action="store_true",
+        help="Load the model once, then classify one JSON sequence per stdin line (one JSON result per line).",
+    )
+    parser.add_argument("--max-batch", type=int, default=16, help="Server mode: most sequences per forward pass.")
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="Server mode: how long to wait for more lines after the first one before running a batch.",
+    )
     parser.add_argument(
         "--low-pass-window",
         type=int,
@@ -48,112 +107,334 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def load_sequence(payload: Dict) -> np.ndarray:
-    features = payload.get("features")
-    if not features:
+@functools.lru_cache(maxsize=1)
+def load_config(path: Path, mtime: float) -> Dict:
+    """Parse the config once per file version; pass path.stat().st_mtime so edits are picked up."""
+    config = json.loads(path.read_text(encoding="utf8"))
+    config["num_features"] = len(config["feature_names"])
+    return config
+
+
+def load_sequence(payload: Dict, base_dir: Path | None = None) -> np.ndarray:
+    features = load_features(payload, base_dir)
+    if features.size == 0:
         raise ValueError("Input sequence has no features.")
-    return np.array(features, dtype=np.float32)
+    if not np.isfinite(features).all():
+        raise ValueError("Input sequence contains NaN, infinite or null values.")
+    return features
 
 
 def low_pass_filter(sequence: np.ndarray, window: int) -> np.ndarray:
     if window <= 1 or sequence.shape[0] < 2:
         return sequence
-    kernel = np.ones(window, dtype=np.float32) / window
-    filtered = np.empty_like(sequence)
-    for col in range(sequence.shape[1]):
-        filtered[:, col] = np.convolve(sequence[:, col], kernel, mode="same")
-    return filtered
+    # Box filter as differences of a running sum, all columns at once. Zero rows before
+    # and a held total after reproduce np.convolve(..., mode="same") at the edges.
+    num_frames = sequence.shape[0]
+    lead = window // 2 + 1
+    sums = np.empty((num_frames + window, sequence.shape[1]), dtype=np.float64)
+    sums[:lead] = 0.0
+    np.cumsum(sequence, axis=0, out=sums[lead : lead + num_frames])
+    sums[lead + num_frames :] = sums[lead + num_frames - 1]
+    filtered = sums[window:] - sums[:-window]
+    filtered *= 1.0 / window
+    return filtered.astype(np.float32)
 
 
-def compute_idle_stats(sequence: np.ndarray) -> Dict[str, float]:
-    pressure = sequence[:, 0]
-    return {
-        "pressure_std": float(np.std(pressure)),
-        "pressure_mean_abs": float(np.mean(np.abs(pressure))),
-        "accel_std_max": float(np.max(np.std(sequence[:, 1:4], axis=0))),
-        "gyro_std_max": float(np.max(np.std(sequence[:, 4:7], axis=0))),
-    }
+def compute_idle_stats(sequence: np.ndarray) -> np.ndarray:
+    """Return [pressure_std, |pressure_mean|, accel_std_max, gyro_std_max], matching idle_thresholds()."""
+    # One variance reduction covers pressure, accel and gyro columns together.
+    std = np.sqrt(sequence[:, :7].var(axis=0))
+    return np.array(
+        [std[0], np.abs(sequence[:, 0]).mean(), std[1:4].max(), std[4:7].max()],
+        dtype=np.float32,
+    )
 
 
-def detect_idle(stats: Dict[str, float], args: argparse.Namespace) -> bool:
-    return (
-        stats["pressure_std"] <= args.idle_pressure_std
-        and stats["pressure_mean_abs"] <= args.idle_pressure_mean
-        and stats["accel_std_max"] <= args.idle_accel_std
-        and stats["gyro_std_max"] <= args.idle_gyro_std
-    )
+def idle_thresholds(args: argparse.Namespace) -> np.ndarray:
+    return np.array([args.idle_pressure_std, args.idle_pressure_mean, args.idle_accel_std, args.idle_gyro_std])
 
 
-def main() -> None:
-    args = parse_args()
-    if args.input:
-        payload = json.loads(args.input.read_text(encoding="utf8"))
+def detect_idle(stats: np.ndarray, thresholds: np.ndarray) -> bool:
+    return bool((stats <= thresholds).all())
+
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    cpus: Set[int] = set()
+    for part in spec.split(","):
+        start, _, end = part.strip().partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def build_engine(args: argparse.Namespace, config: Dict) -> Dict:
+    """Build the model once and keep it with the device, labels and normalization tensors."""
+    if args.cpus:
+        if not hasattr(os, "sched_setaffinity"):
+            raise ValueError("--cpus needs os.sched_setaffinity, which this platform lacks.")
+        os.sched_setaffinity(0, parse_cpu_list(args.cpus))
+    if args.backend == "onnxruntime":
+        return build_onnx_engine(args, config)
+
+    import torch
+    from torch import nn
+
+    from sequence_model import build_model
+
+    device = torch.device(args.device)
+    if device.type == "cpu":
+        torch.set_num_threads(max(args.num_threads, 1))
+        # Inference never runs independent ops side by side, so one inter-op thread is enough.
+        torch.set_num_interop_threads(1)
+
+    # Scripting, freezing and warm-up cost more than a single forward pass saves, so only a
+    # long-lived server does them; the one-shot CLI runs the plain module.
+    jit = args.server and not args.no_jit
+    normalizes_input = args.model.suffix == ".ts"
+    if normalizes_input:
+        # TorchScript exports (export_torchscript.py) normalize inside the graph.
+        model = torch.jit.load(str(args.model), map_location=device)
     else:
-        raw = sys.stdin.read()
-        if not raw.strip():
-            raise ValueError("No JSON input provided on stdin.")
-        payload = json.loads(raw)
+        model = build_model(config.get("model", {}), config["num_features"], len(config["labels"]))
+        # mmap pages the weights in lazily (shared through the page cache across runs), and
+        # assign=True adopts those tensors instead of copying them into freshly allocated ones.
+        state_dict = torch.load(args.model, map_location="cpu", mmap=True, weights_only=True)
+        model.load_state_dict(state_dict, assign=True)
+        model.eval()
+        if device.type == "cpu" and args.quantize != "off":
+            # Dynamic int8 kernels are CPU-only. Quantizing the GRU as well flipped a few
+            # labels on augmented samples, so "linear" keeps it in float32.
+            layers = {nn.Linear, nn.GRU} if args.quantize == "all" else {nn.Linear}
+            with warnings.catch_warnings():
+                # torch.ao.quantization and quantized tensors warn that they are deprecated;
+                # that stderr noise would reach the Node caller.
+                warnings.filterwarnings("ignore", message=".*deprecated")
+                model = torch.ao.quantization.quantize_dynamic(model, layers, dtype=torch.qint8)
+        if jit:
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message=".*deprecated")
+                model = torch.jit.script(model)
+    # Half precision halves the GRU's weight traffic on GPUs. Exported .ts graphs normalize raw
+    # sensor values internally, which float16 represents too coarsely, so they stay float32.
+    half = device.type in ("cuda", "mps") and not normalizes_input and not args.fp32
+    model.to(device).eval()
+    if half:
+        model.half()
+    if jit:
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=".*deprecated")
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+    engine = {
+        "backend": "torch",
+        "model": model,
+        "device": device,
+        "labels": config["labels"],
+        "normalizes_input": normalizes_input,
+        "half": half,
+        # Reused for every batch; CPU-resident because pack_padded_sequence wants CPU lengths.
+        "lengths": torch.empty(max(args.max_batch, 1), dtype=torch.long),
+        "feature_mean": torch.as_tensor(config["feature_mean"], dtype=torch.float32, device=device),
+        # Stored as a reciprocal so normalization is a subtract and a multiply.
+        "feature_inv_std": torch.as_tensor(config["feature_std"], dtype=torch.float32, device=device).reciprocal_(),
+    }
+    if args.server:
+        # The TorchScript executor specializes over its first calls; pay that here, not on the first request.
+        warmup_engine(engine, config)
+    return engine
+
+
+def build_onnx_engine(args: argparse.Namespace, config: Dict) -> Dict:
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = max(args.num_threads, 1)
+    options.inter_op_num_threads = 1
+    # export_onnx.py folds normalization into the graph, so raw features go straight in.
+    session = ort.InferenceSession(str(args.model), options, providers=["CPUExecutionProvider"])
+    engine = {"backend": "onnxruntime", "session": session, "labels": config["labels"]}
+    if args.server:
+        warmup_engine(engine, config)
+    return engine
+
 
-    config = json.loads(args.config.read_text(encoding="utf8"))
-    labels = config["labels"]
-    feature_mean = torch.tensor(config["feature_mean"], dtype=torch.float32)
-    feature_std = torch.tensor(config["feature_std"], dtype=torch.float32)
+def warmup_engine(engine: Dict, config: Dict) -> None:
+    warmup = np.zeros((100, config["num_features"]), dtype=np.float32)
+    for _ in range(2):
+        classify_batch(engine, [warmup])
 
-    sequence_np = load_sequence(payload)
-    if sequence_np.shape[1] != len(config["feature_names"]):
+
+def prepare_sequence(payload: Dict, config: Dict, args: argparse.Namespace, base_dir: Path | None = None) -> np.ndarray:
+    sequence_np = load_sequence(payload, base_dir)
+    if sequence_np.shape[1] != config["num_features"]:
         raise ValueError(
-            f"Expected {len(config['feature_names'])} features per frame, got {sequence_np.shape[1]}."
+            f"Expected {config['num_features']} features per frame, got {sequence_np.shape[1]}."
         )
-    sequence_np = low_pass_filter(sequence_np, args.low_pass_window)
+    return low_pass_filter(sequence_np, args.low_pass_window)
+
 
+def idle_result(
+    sequence_np: np.ndarray, labels: List[str], args: argparse.Namespace, thresholds: np.ndarray
+) -> Dict | None:
+    if not args.auto_idle:
+        return None
     idle_stats = compute_idle_stats(sequence_np)
-    if args.auto_idle:
-        print(
-            "[auto-idle stats] "
-            f"pressure_std={idle_stats['pressure_std']:.4f}, "
-            f"|pressure_mean|={idle_stats['pressure_mean_abs']:.4f}, "
-            f"accel_std_max={idle_stats['accel_std_max']:.4f}, "
-            f"gyro_std_max={idle_stats['gyro_std_max']:.4f}",
-            file=sys.stderr,
-        )
+    print(
+        "[auto-idle stats] "
+        f"pressure_std={idle_stats[0]:.4f}, "
+        f"|pressure_mean|={idle_stats[1]:.4f}, "
+        f"accel_std_max={idle_stats[2]:.4f}, "
+        f"gyro_std_max={idle_stats[3]:.4f}",
+        file=sys.stderr,
+    )
+    if not detect_idle(idle_stats, thresholds):
+        return None
+    return {
+        "label": args.idle_label,
+        "probability": 1.0,
+        "probabilities": dict(zip(labels, [1.0 if label == args.idle_label else 0.0 for label in labels])),
+        "detected_idle": True,
+    }
+
 
-    if args.auto_idle and detect_idle(idle_stats, args):
-        result = {
-            "label": args.idle_label,
-            "probability": 1.0,
-            "probabilities": {label: (1.0 if label == args.idle_label else 0.0) for label in labels},
-            "detected_idle": True,
+def format_results(labels: List[str], order: List[int], best: List[int], probs: List[List[float]]) -> List[Dict]:
+    results: List[Dict] = [{}] * len(order)
+    for row, i in enumerate(order):
+        results[i] = {
+            "label": labels[best[row]],
+            "probability": probs[row][best[row]],
+            "probabilities": dict(zip(labels, probs[row])),
         }
-        print(json.dumps(result, ensure_ascii=False))
-        return
+    return results
 
-    sequence = torch.from_numpy(sequence_np)
-    sequence = (sequence - feature_mean) / feature_std
-    sequence = sequence.unsqueeze(0)  # (1, seq_len, feat)
-    lengths = torch.tensor([sequence_np.shape[0]], dtype=torch.long)
 
-    device = torch.device(args.device)
-    model_cfg = config.get("model", {})
-    model = SequenceGRU(
-        feature_dim=sequence_np.shape[1],
-        hidden_dim=model_cfg.get("hidden_dim", 128),
-        num_classes=len(labels),
-        num_layers=model_cfg.get("num_layers", 2),
-        dropout=model_cfg.get("dropout", 0.1),
+def classify_batch_onnx(engine: Dict, sequences: Sequence[np.ndarray], order: List[int]) -> List[Dict]:
+    lengths = [sequences[i].shape[0] for i in order]
+    batch = np.zeros((len(order), lengths[0], sequences[order[0]].shape[1]), dtype=np.float32)
+    for row, i in enumerate(order):
+        batch[row, : lengths[row]] = sequences[i]
+    logits = engine["session"].run(None, {"sequences": batch, "lengths": np.asarray(lengths, dtype=np.int64)})[0]
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    probs = exp / exp.sum(axis=1, keepdims=True)
+    return format_results(engine["labels"], order, logits.argmax(axis=1).tolist(), probs.tolist())
+
+
+def classify_batch(engine: Dict, sequences: Sequence[np.ndarray]) -> List[Dict]:
+    # Longest first, so the packed GRU input is already in the order it needs.
+    order = sorted(range(len(sequences)), key=lambda i: sequences[i].shape[0], reverse=True)
+    if engine["backend"] == "onnxruntime":
+        return classify_batch_onnx(engine, sequences, order)
+
+    import torch
+
+    device = engine["device"]
+    lengths = [sequences[i].shape[0] for i in order]
+    # On CUDA, pad straight into page-locked memory so the copy below runs asynchronously.
+    batch = torch.zeros(
+        (len(order), lengths[0], sequences[order[0]].shape[1]),
+        dtype=torch.float32,
+        pin_memory=device.type == "cuda",
     )
-    state_dict = torch.load(args.model, map_location=device)
-    model.load_state_dict(state_dict)
-    model.to(device).eval()
+    lengths_t = engine["lengths"]
+    if len(order) > lengths_t.numel():
+        lengths_t = torch.empty(len(order), dtype=torch.long)
+    lengths_t = lengths_t[: len(order)]
+    for row, i in enumerate(order):
+        batch[row, : lengths[row]] = torch.from_numpy(sequences[i])
+        lengths_t[row] = lengths[row]
+    batch = batch.to(device, non_blocking=True)
+    if not engine["normalizes_input"]:
+        batch.sub_(engine["feature_mean"]).mul_(engine["feature_inv_std"])
+    if engine["half"]:
+        batch = batch.half()
 
-    with torch.no_grad():
-        logits = model(sequence.to(device), lengths.to(device))
-        probs = nn.functional.softmax(logits, dim=1).cpu().numpy()[0]
-    best_idx = int(np.argmax(probs))
-    result = {
-        "label": labels[best_idx],
-        "probability": float(probs[best_idx]),
-        "probabilities": {labels[i]: float(probs[i]) for i in range(len(labels))},
-    }
+    with torch.inference_mode():
+        logits = engine["model"](batch, lengths_t).float()
+        # Softmax is monotonic, so the top label comes straight from the logits.
+        best = logits.argmax(dim=1).tolist()
+        probs = torch.softmax(logits, dim=1).tolist()
+    return format_results(engine["labels"], order, best, probs)
+
+
+def classify(engine: Dict, sequence_np: np.ndarray) -> Dict:
+    return classify_batch(engine, [sequence_np])[0]
+
+
+def read_batches(stream: BinaryIO, max_batch: int, max_wait_ms: float) -> Iterator[List[bytes]]:
+    """Group non-empty lines that arrive within max_wait_ms of the first one, up to max_batch."""
+    lines: queue.Queue = queue.Queue()
+
+    def pump() -> None:
+        try:
+            for line in stream:
+                if line.strip():
+                    lines.put(line)
+        finally:
+            # Always signal the end, even if reading fails, so the consumer cannot block forever.
+            lines.put(None)
+
+    threading.Thread(target=pump, daemon=True).start()
+    while True:
+        line = lines.get()
+        if line is None:
+            return
+        batch = [line]
+        deadline = time.monotonic() + max_wait_ms / 1000.0
+        while len(batch) < max_batch:
+            try:
+                line = lines.get(timeout=max(deadline - time.monotonic(), 0.0))
+            except queue.Empty:
+                break
+            if line is None:
+                yield batch
+                return
+            batch.append(line)
+        yield batch
+
+
+def serve(engine: Dict, config: Dict, args: argparse.Namespace) -> None:
+    """Answer one JSON sequence per stdin line with one JSON result per stdout line, in input order."""
+    thresholds = idle_thresholds(args)
+    # Read raw bytes: undecodable input then fails its own line in parse_payload instead of the reader.
+    for lines in read_batches(sys.stdin.buffer, max(args.max_batch, 1), args.max_wait_ms):
+        results: List[Dict | None] = []
+        pending: Dict[int, np.ndarray] = {}
+        for line in lines:
+            try:
+                sequence_np = prepare_sequence(parse_payload(line), config, args)
+                result = idle_result(sequence_np, config["labels"], args, thresholds)
+            except Exception as exc:
+                # Any bad line becomes an error result; it must not take the server down.
+                result = {"error": str(exc)}
+            if result is None:
+                pending[len(results)] = sequence_np
+            results.append(result)
+        if pending:
+            for idx, result in zip(pending, classify_batch(engine, list(pending.values()))):
+                results[idx] = result
+        for result in results:
+            print(json.dumps(result, ensure_ascii=False))
+        sys.stdout.flush()
+
+
+def main() -> None:
+    args = parse_args()
+    config = load_config(args.config, args.config.stat().st_mtime)
+    if args.server:
+        serve(build_engine(args, config), config, args)
+        return
+
+    if args.input:
+        payload = parse_payload(args.input.read_bytes())
+    else:
+        raw = sys.stdin.read()
+        if not raw.strip():
+            raise ValueError("No JSON input provided on stdin.")
+        payload = parse_payload(raw)
+
+    sequence_np = prepare_sequence(payload, config, args, args.input.parent if args.input else None)
+    # Idle windows are answered before the model is loaded.
+    result = idle_result(sequence_np, config["labels"], args, idle_thresholds(args))
+    if result is None:
+        result = classify(build_engine(args, config), sequence_np)
     print(json.dumps(result, ensure_ascii=False))
 
 
@@ -0,0 +1,83 @@
+"""
+Reading PillowMate sequence files, shared by augmentation, training and inference.
+
+Features can be stored three ways (see augment_sequences.py --output-format):
+inline nested lists under "features", base64 float32 bytes under
+"features_b64" + "features_shape", or a compressed .npz sidecar named by
+"features_file". This module only needs NumPy, so importing it never pulls in
+PyTorch.
+"""
+
+from __future__ import annotations
+
+import base64
+import itertools
+import json
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+# Optional: orjson parses sequence JSON much faster than json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def parse_payload(raw: str | bytes) -> Dict:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def read_payload(path: Path) -> Dict:
+    return parse_payload(path.read_bytes())
+
+
+def features_to_array(payload: Dict) -> np.ndarray:
+    """Decode inline features (nested lists or base64) to a float32 array; empty input gives shape (0,)."""
+    if "features_b64" in payload:
+        # Little-endian float32 bytes written by augment_sequences.py --output-format b64.
+        shape = payload["features_shape"]
+        if not isinstance(shape, list) or len(shape) != 2:
+            raise ValueError("features_shape must be [frames, features].")
+        raw = bytearray(base64.b64decode(payload["features_b64"]))
+        return np.frombuffer(raw, dtype="<f4").reshape(shape).astype(np.float32, copy=False)
+    features = payload.get("features") or []
+    if not features:
+        return np.empty((0,), dtype=np.float32)
+    if not isinstance(features, list) or not all(isinstance(frame, list) for frame in features):
+        raise ValueError("Features must be a list of frames, each a list of numbers.")
+    # Flatten the nested frame lists straight into a float32 buffer.
+    width = len(features[0])
+    total = sum(map(len, features))
+    if total != len(features) * width:
+        raise ValueError("Feature frames have inconsistent lengths.")
+    try:
+        flat = np.fromiter(itertools.chain.from_iterable(features), dtype=np.float32, count=total)
+    except TypeError as exc:
+        raise ValueError(f"Feature values must be numbers: {exc}") from exc
+    return flat.reshape(len(features), width)
+
+
+def load_features(payload: Dict, base_dir: Path | None = None) -> np.ndarray:
+    """
+    Return the payload's features as float32, whichever way they were stored.
+
+    A relative "features_file" is resolved against ``base_dir`` (normally the
+    directory of the JSON file) when one is given. Raises ValueError for
+    payloads that are not a JSON object or features that are not 2-D.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError(f"Expected a JSON object, got {type(payload).__name__}.")
+    if "features_file" in payload:
+        features_path = Path(payload["features_file"])
+        if base_dir is not None:
+            features_path = base_dir / features_path
+        with np.load(features_path) as archive:
+            features = archive["features"].astype(np.float32, copy=False)
+        if features.size and features.ndim != 2:
+            raise ValueError(f"{features_path} features must be 2-D, got shape {features.shape}.")
+        return features
+    return features_to_array(payload)
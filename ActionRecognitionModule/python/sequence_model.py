@@ -4,7 +4,7 @@ Neural network architectures for PillowMate sequence classification.
 
 from __future__ import annotations
 
-from typing import Tuple
+from typing import Dict, Tuple
 
 import torch
 from torch import nn
@@ -44,16 +44,100 @@ class SequenceGRU(nn.Module):
             sequences: Tensor of shape (batch, max_len, feature_dim).
             lengths: Actual lengths for each sequence (batch,).
         """
-        packed = pack_padded_sequence(
-            sequences,
-            lengths.cpu(),
-            batch_first=True,
-            enforce_sorted=False,
-        )
-        _, hidden = self.gru(packed)
+        lengths = lengths.cpu()
+        if sequences.size(0) == 1:
+            # A single sequence needs no packing; just drop any trailing padding.
+            _, hidden = self.gru(sequences[:, : int(lengths[0])])
+        else:
+            # Callers that already sort longest-first (sequence_infer) skip the internal sort.
+            already_sorted = bool((lengths[:-1] >= lengths[1:]).all())
+            packed = pack_padded_sequence(
+                sequences,
+                lengths,
+                batch_first=True,
+                enforce_sorted=already_sorted,
+            )
+            _, hidden = self.gru(packed)
         # hidden shape: (num_layers * 2, batch, hidden_dim)
         forward_final = hidden[-2]
         backward_final = hidden[-1]
         encoded = torch.cat([forward_final, backward_final], dim=1)
-        logits = self.classifier(encoded)
-        return logits
\ No newline at end of file
+        if self.training:
+            return self.classifier(encoded)
+        # Dropout is an identity at eval time; call the two Linear layers directly with an
+        # in-place ReLU. The Sequential stays so saved state_dict keys (classifier.0/.3) still load.
+        return self.classifier[3](torch.relu_(self.classifier[0](encoded)))
+
+
+class SequenceTCN(nn.Module):
+    """Stacked Conv1d + GLU encoder with masked mean pooling; no step-by-step recurrence."""
+
+    def __init__(
+        self,
+        feature_dim: int,
+        hidden_dim: int,
+        num_classes: int,
+        num_layers: int = 3,
+        kernel_size: int = 5,
+        dropout: float = 0.1,
+    ) -> None:
+        super().__init__()
+        if kernel_size % 2 == 0:
+            raise ValueError("kernel_size must be odd so every layer keeps the sequence length.")
+        self.blocks = nn.ModuleList(
+            nn.Sequential(
+                nn.Conv1d(feature_dim if i == 0 else hidden_dim, hidden_dim * 2, kernel_size, padding=kernel_size // 2),
+                nn.GLU(dim=1),
+                nn.Dropout(dropout),
+            )
+            for i in range(num_layers)
+        )
+        self.classifier = nn.Linear(hidden_dim, num_classes)
+
+    def forward(self, sequences: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            sequences: Tensor of shape (batch, max_len, feature_dim).
+            lengths: Actual lengths for each sequence (batch,).
+        """
+        lengths = lengths.to(sequences.device)
+        steps = torch.arange(sequences.size(1), device=sequences.device)
+        # Zero padded frames before every layer so a padded batch matches one-by-one inference.
+        mask = (steps.unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(1).to(sequences.dtype)
+        encoded = sequences.transpose(1, 2) * mask
+        for block in self.blocks:
+            encoded = block(encoded) * mask
+        pooled = encoded.sum(dim=2) / lengths.clamp(min=1).unsqueeze(1).to(encoded.dtype)
+        return self.classifier(pooled)
+
+
+def build_model(model_cfg: Dict, feature_dim: int, num_classes: int) -> nn.Module:
+    """Instantiate the architecture named in a config's "model" section (configs without "arch" are GRUs)."""
+    arch = model_cfg.get("arch", "gru")
+    hidden_dim = model_cfg.get("hidden_dim", 128)
+    dropout = model_cfg.get("dropout", 0.1)
+    if arch == "gru":
+        return SequenceGRU(feature_dim, hidden_dim, num_classes, model_cfg.get("num_layers", 2), dropout)
+    if arch == "tcn":
+        return SequenceTCN(
+            feature_dim,
+            hidden_dim,
+            num_classes,
+            model_cfg.get("num_layers", 3),
+            model_cfg.get("kernel_size", 5),
+            dropout,
+        )
+    raise ValueError(f"Unknown model arch {arch!r}; expected 'gru' or 'tcn'.")
+
+
+class NormalizedSequenceModel(nn.Module):
+    """Applies feature normalization inside the graph so exported models take raw features."""
+
+    def __init__(self, model: nn.Module, feature_mean: torch.Tensor, feature_std: torch.Tensor) -> None:
+        super().__init__()
+        self.model = model
+        self.register_buffer("feature_mean", feature_mean)
+        self.register_buffer("feature_std", feature_std)
+
+    def forward(self, sequences: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+        return self.model((sequences - self.feature_mean) / self.feature_std, lengths)
@@ -60,7 +60,8 @@ def _load_env_files():
 
 _ = _load_env_files()
 
-from sequence_model import SequenceGRU
+from sequence_io import load_features, read_payload
+from sequence_model import build_model
 
 
 FEATURE_NAMES = ["pressure_delta", "ax", "ay", "az", "gx", "gy", "gz"]
@@ -90,7 +91,13 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--epochs", type=int, default=25, help="Number of training epochs.")
     parser.add_argument("--batch-size", type=int, default=32, help="Batch size for DataLoader.")
-    parser.add_argument("--hidden-dim", type=int, default=128, help="Hidden dimension for the GRU.")
+    parser.add_argument(
+        "--arch",
+        choices=["gru", "tcn"],
+        default="gru",
+        help="gru: bidirectional GRU. tcn: stacked Conv1d+GLU encoder, much faster to run on CPU.",
+    )
+    parser.add_argument("--hidden-dim", type=int, default=128, help="Hidden dimension for the GRU (TCN channels).")
     parser.add_argument("--learning-rate", type=float, default=1e-3, help="Adam learning rate.")
     parser.add_argument("--val-split", type=float, default=0.2, help="Validation split ratio.")
     parser.add_argument("--random-state", type=int, default=42, help="Deterministic split seed.")
@@ -153,11 +160,17 @@ def parse_args() -> argparse.Namespace:
 def low_pass_filter(sequence: np.ndarray, window: int) -> np.ndarray:
     if window <= 1 or sequence.shape[0] < 2:
         return sequence
-    kernel = np.ones(window, dtype=np.float32) / window
-    filtered = np.empty_like(sequence)
-    for col in range(sequence.shape[1]):
-        filtered[:, col] = np.convolve(sequence[:, col], kernel, mode="same")
-    return filtered
+    # Box filter as differences of a running sum, all columns at once. Zero rows before
+    # and a held total after reproduce np.convolve(..., mode="same") at the edges.
+    num_frames = sequence.shape[0]
+    lead = window // 2 + 1
+    sums = np.empty((num_frames + window, sequence.shape[1]), dtype=np.float64)
+    sums[:lead] = 0.0
+    np.cumsum(sequence, axis=0, out=sums[lead : lead + num_frames])
+    sums[lead + num_frames :] = sums[lead + num_frames - 1]
+    filtered = sums[window:] - sums[:-window]
+    filtered *= 1.0 / window
+    return filtered.astype(np.float32)
 
 
 def load_sequences(data_dirs: Sequence[Path], low_pass_window: int) -> List[Dict]:
@@ -169,17 +182,16 @@ def load_sequences(data_dirs: Sequence[Path], low_pass_window: int) -> List[Dict
         raise FileNotFoundError(f"No JSON files found in {joined}. Run the sequence collector first.")
     records = []
     for path in paths:
-        with path.open() as fp:
-            payload = json.load(fp)
-        features = payload.get("features", [])
-        if not features:
+        payload = read_payload(path)
+        features = load_features(payload, path.parent)
+        if features.size == 0:
             continue
-        if len(features[0]) != len(FEATURE_NAMES):
+        if features.ndim != 2 or features.shape[1] != len(FEATURE_NAMES):
             raise ValueError(f"{path} feature dimension mismatch. Expected {len(FEATURE_NAMES)} values per frame.")
         records.append(
             {
                 "label": payload["label"],
-                "features": low_pass_filter(np.array(features, dtype=np.float32), low_pass_window),
+                "features": low_pass_filter(features, low_pass_window),
                 "sample_ms": payload.get("sample_ms", 20),
                 "path": str(path),
             }
@@ -190,18 +202,12 @@ def load_sequences(data_dirs: Sequence[Path], low_pass_window: int) -> List[Dict
 
 
 def compute_feature_stats(records: Sequence[Dict]) -> Tuple[np.ndarray, np.ndarray]:
-    total_frames = 0
-    feature_sum = np.zeros(len(FEATURE_NAMES), dtype=np.float64)
-    feature_sq_sum = np.zeros(len(FEATURE_NAMES), dtype=np.float64)
-    for record in records:
-        features = record["features"]
-        total_frames += features.shape[0]
-        feature_sum += features.sum(axis=0)
-        feature_sq_sum += (features ** 2).sum(axis=0)
-    if total_frames == 0:
+    frames = np.concatenate([record["features"] for record in records], axis=0) if records else np.empty((0,))
+    if frames.shape[0] == 0:
         raise ValueError("Cannot compute normalization statistics with zero frames.")
-    mean = feature_sum / total_frames
-    variance = feature_sq_sum / total_frames - mean**2
+    # Frames stay float32; only the reductions accumulate in float64.
+    mean = frames.mean(axis=0, dtype=np.float64)
+    variance = frames.var(axis=0, dtype=np.float64)
     std = np.sqrt(np.clip(variance, 1e-6, None))
     return mean.astype(np.float32), std.astype(np.float32)
 
@@ -340,7 +346,7 @@ def evaluate(
     correct = 0
     total = 0
     misclassified: Dict[str, Dict[str, int]] = {label: {} for label in label_names} if log_misclassified else {}
-    with torch.no_grad():
+    with torch.inference_mode():
         for sequences, lengths, labels in loader:
             sequences = sequences.to(device)
             lengths = lengths.to(device)
@@ -373,7 +379,7 @@ def save_config(
     labels: List[str],
     mean: np.ndarray,
     std: np.ndarray,
-    model_params: Dict[str, int],
+    model_params: Dict[str, int | float | str],
 ) -> None:
     payload = {
         "labels": labels,
@@ -481,13 +487,16 @@ def main() -> None:
     device = choose_device(args.device)
     print(f"Using device: {device}")
     model_kwargs = {
+        "arch": args.arch,
         "feature_dim": len(FEATURE_NAMES),
         "hidden_dim": args.hidden_dim,
         "num_classes": len(labels),
-        "num_layers": 2,
+        "num_layers": 2 if args.arch == "gru" else 3,
         "dropout": 0.1,
     }
-    model = SequenceGRU(**model_kwargs).to(device)
+    if args.arch == "tcn":
+        model_kwargs["kernel_size"] = 5
+    model = build_model(model_kwargs, len(FEATURE_NAMES), len(labels)).to(device)
 
     criterion = nn.CrossEntropyLoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=args.learning_rate)